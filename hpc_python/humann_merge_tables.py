@@ -3,13 +3,14 @@
 Merge HUMAnN per-sample outputs into cohort-wide matrices.
 
 Steps:
- 1. Copy each sample's output tables into staging folders (one per table type)
-    to keep the files organized.
- 2. Run humann_join_tables on each staging folder to create a merged matrix.
- 3. Merge MetaPhlAn bugs list profiles as well.
+ 1. Symlink each sample's output tables into staging folders (one per table
+    type) to keep the files organized without duplicating data.
+ 2. Outer-join each staging folder into a merged matrix with pandas, running
+    the table types in parallel.
+ 3. Merge MetaPhlAn bugs list profiles as well (in-process with pandas).
 
-Run from an interactive session inside the HUMAnN conda environment so the
-humann_* utilities are on PATH.
+Run from an interactive session inside the HUMAnN conda environment so pandas
+is available.
 """
 
 from __future__ import annotations
@@ -17,14 +18,21 @@ from __future__ import annotations
 import argparse
 import os
 import shutil
-import subprocess
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict
 
+import pandas as pd
+
 OUTPUT_ROOT = Path("/work3/trhova/humann_project/metagenomics_80/humann_run/output")
 STAGING_ROOT = OUTPUT_ROOT.parent / "merged_inputs"
 MERGED_ROOT = OUTPUT_ROOT.parent / "merged_tables"
-HUMANN_ENV_BIN = Path("/work3/trhova/humann_project/humann38/bin")
+STAGE_WORKERS = 32
+# read_csv releases the GIL while parsing, so threads overlap per-sample reads.
+READ_WORKERS = 8
+# Each table join holds a dense features x samples frame; keep few in memory at once.
+JOIN_WORKERS = 2
 
 TABLE_SPECS: Dict[str, Dict[str, str]] = {
     "genefamilies": {
@@ -74,73 +82,158 @@ TABLE_SPECS: Dict[str, Dict[str, str]] = {
 }
 
 
-def run_command(cmd: list[str]) -> None:
-    env = os.environ.copy()
-    env["PATH"] = f"{HUMANN_ENV_BIN}:{env['PATH']}"
-    print(" ".join(cmd))
-    subprocess.run(cmd, check=True, env=env)
-
-
 def prepare_directory(path: Path) -> None:
     if path.exists():
         shutil.rmtree(path)
     path.mkdir(parents=True, exist_ok=True)
 
 
+def list_sample_files(sample_dir: Path) -> set[str]:
+    """Return paths (relative to sample_dir) of files that TABLE_SPECS may match.
+
+    One scandir per directory replaces a stat() per expected table, which
+    matters on Lustre where metadata operations are the slow path.
+    """
+    with os.scandir(sample_dir) as entries:
+        present = {entry.name for entry in entries}
+    temp_dir = f"{sample_dir.name}_humann_temp"
+    if temp_dir in present and os.path.isdir(sample_dir / temp_dir):
+        with os.scandir(sample_dir / temp_dir) as entries:
+            present.update(f"{temp_dir}/{entry.name}" for entry in entries)
+    return present
+
+
+def link_table(src: Path, dest: Path) -> None:
+    """Stage src as a symlink at dest, replacing any link left by a previous run."""
+    dest.unlink(missing_ok=True)
+    os.symlink(src.resolve(), dest)
+
+
 def copy_tables(output_root: Path, staging_root: Path) -> Dict[str, int]:
-    counts = {name: 0 for name in TABLE_SPECS}
+    counts: Counter[str] = Counter({name: 0 for name in TABLE_SPECS})
     for table_name, spec in TABLE_SPECS.items():
         prepare_directory(staging_root / table_name)
 
+    pairs: list[tuple[Path, Path]] = []
     for sample_dir in sorted(p for p in output_root.iterdir() if p.is_dir()):
         sample = sample_dir.name
+        present = list_sample_files(sample_dir)
         for table_name, spec in TABLE_SPECS.items():
-            rel_path = Path(spec["pattern"].format(sample=sample))
-            src = sample_dir / rel_path
-            if not src.exists():
+            rel_path = spec["pattern"].format(sample=sample)
+            if rel_path not in present:
                 continue
-            dest = staging_root / table_name / src.name
-            dest.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(src, dest)
+            src = sample_dir / rel_path
+            pairs.append((src, staging_root / table_name / src.name))
             counts[table_name] += 1
+
+    # Links are independent metadata operations; keep many in flight on /work3.
+    with ThreadPoolExecutor(max_workers=STAGE_WORKERS) as executor:
+        list(executor.map(lambda pair: link_table(*pair), pairs))
     return counts
 
 
+def read_metaphlan_profile(path: Path) -> pd.Series:
+    """Load relative abundances from one MetaPhlAn bugs list, indexed by clade."""
+    frame = pd.read_csv(
+        path,
+        sep="\t",
+        comment="#",
+        header=None,
+        usecols=[0, 2],
+        names=["clade_name", path.stem],
+        index_col=0,
+        dtype={"clade_name": str, path.stem: float},
+        engine="c",
+    )
+    return frame[path.stem]
+
+
+def read_mpa_version(path: Path) -> str | None:
+    """Return the '#mpa_v...' database header line of a MetaPhlAn profile, if any."""
+    with path.open() as handle:
+        for line in handle:
+            if not line.startswith("#"):
+                break
+            if line.startswith("#mpa_"):
+                return line.rstrip("\n")
+    return None
+
+
+def merge_metaphlan(files: list[Path], output_path: Path) -> None:
+    """Outer-join MetaPhlAn bugs lists on clade name, filling absent clades with 0."""
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        versions = set(executor.map(read_mpa_version, files))
+        if len(versions) > 1:
+            # merge_metaphlan_tables.py refuses to mix database versions too.
+            raise RuntimeError(
+                "MetaPhlAn profiles were made with different databases: "
+                + ", ".join(sorted(v or "<none>" for v in versions))
+            )
+        profiles = list(executor.map(read_metaphlan_profile, files))
+    merged = pd.concat(profiles, axis=1)
+    merged.fillna(0.0, inplace=True)
+    merged.index.name = "clade_name"
+    (mpa_version,) = versions
+    with output_path.open("w") as handle:
+        if mpa_version:
+            handle.write(f"{mpa_version}\n")
+        merged.to_csv(handle, sep="\t")
+
+
+# Features humann_join_tables writes ahead of everything else, in this order.
+TOP_FEATURES = ("UNMAPPED", "UNINTEGRATED", "UNGROUPED")
+
+
+def feature_sort_key(feature: str) -> tuple[int, list[str]]:
+    """Order features like HUMAnN's util.fsort: specials first, strata under their parent."""
+    rank = TOP_FEATURES.index(feature) if feature in TOP_FEATURES else len(TOP_FEATURES)
+    return rank, feature.split("|")
+
+
+def read_humann_table(path: Path) -> pd.DataFrame:
+    """Load one per-sample HUMAnN table, indexed by its feature column."""
+    return pd.read_csv(path, sep="\t", index_col=0, engine="c")
+
+
+def join_tables_pandas(stage_dir: Path, output_path: Path) -> None:
+    """Outer-join staged HUMAnN tables on feature, like humann_join_tables."""
+    files = sorted(stage_dir.glob("*.tsv"))
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        tables = list(executor.map(read_humann_table, files))
+    index_name = tables[0].index.name
+    merged = pd.concat(tables, axis=1)
+    del tables
+    merged = merged.reindex(sorted(merged.index, key=feature_sort_key))
+    merged.fillna(0.0, inplace=True)
+    merged.index.name = index_name
+    merged.to_csv(output_path, sep="\t")
+    print(f"Wrote {output_path}")
+
+
 def join_tables(staging_root: Path, merged_root: Path, counts: Dict[str, int]) -> None:
     merged_root.mkdir(parents=True, exist_ok=True)
+    jobs: list[tuple[Path, Path]] = []
     for table_name, spec in TABLE_SPECS.items():
         stage_dir = staging_root / table_name
         if table_name == "metaphlan_bugs":
             continue
         if counts.get(table_name, 0) == 0:
-            print(f"Skipping {table_name}: no files copied.")
+            print(f"Skipping {table_name}: no files staged.")
             continue
-        output_path = merged_root / spec["merged"]
-        run_command(
-            [
-                "humann_join_tables",
-                "--input",
-                str(stage_dir),
-                "--output",
-                str(output_path),
-            ]
-        )
+        jobs.append((stage_dir, merged_root / spec["merged"]))
+
+    # Table types are independent; merge a few of them concurrently.
+    if jobs:
+        with ProcessPoolExecutor(max_workers=min(JOIN_WORKERS, len(jobs))) as executor:
+            list(executor.map(join_tables_pandas, *zip(*jobs)))
 
     # Handle MetaPhlAn bugs lists separately.
     metaphlan_stage = staging_root / "metaphlan_bugs"
     if counts.get("metaphlan_bugs", 0):
-        print("Joining MetaPhlAn bugs lists with merge_metaphlan_tables.py")
+        print("Joining MetaPhlAn bugs lists")
         merged_bugs = merged_root / "metaphlan_bugs_list.tsv"
         files = sorted(metaphlan_stage.glob("*.tsv"))
-        env = os.environ.copy()
-        env["PATH"] = f"{HUMANN_ENV_BIN}:{env['PATH']}"
-        with merged_bugs.open("w") as handle:
-            subprocess.run(
-                ["merge_metaphlan_tables.py", *[str(f) for f in files]],
-                check=True,
-                env=env,
-                stdout=handle,
-            )
+        merge_metaphlan(files, merged_bugs)
 
 
 def main() -> None:
@@ -155,7 +248,7 @@ def main() -> None:
         "--staging-root",
         default=STAGING_ROOT,
         type=Path,
-        help="Where to copy per-sample tables before merging.",
+        help="Where to link per-sample tables before merging.",
     )
     parser.add_argument(
         "--merged-root",
@@ -14,19 +14,28 @@ from __future__ import annotations
 import argparse
 import os
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict
 
+from job_resources import allocated_cpus, positive_int
+
 OUTPUT_ROOT = Path("/work3/trhova/humann_project/metagenomics_80/humann_run/output")
 HUMANN_ENV_BIN = Path("/work3/trhova/humann_project/humann38/bin")
+# Environment for humann_* subprocesses, built once rather than per command.
+_RUN_ENV = {**os.environ, "PATH": f"{HUMANN_ENV_BIN}:{os.environ['PATH']}"}
+UNIREF_PROBE_SIZE = 4096
+DONE_MARKER = ".postprocess_done"
+
+# A cohort is profiled against one UniRef database, so the regroup spec is
+# detected once per output root (per worker process) and reused.
+_UNIREF_CACHE: Dict[Path, str] = {}
 
 
 def run_command(cmd: list[str]) -> None:
     """Run a shell command and echo it first."""
     print(" ".join(cmd))
-    env = os.environ.copy()
-    env["PATH"] = f"{HUMANN_ENV_BIN}:{env['PATH']}"
-    subprocess.run(cmd, check=True, env=env)
+    subprocess.run(cmd, check=True, env=_RUN_ENV)
 
 
 def normalize_table(table_path: Path, units: str, output_path: Path) -> None:
@@ -48,14 +57,21 @@ def normalize_table(table_path: Path, units: str, output_path: Path) -> None:
 
 def detect_uniref_scope(genefamilies_file: Path) -> str:
     """Return humann_regroup_table group spec based on UniRef IDs."""
-    with genefamilies_file.open() as handle:
-        for line in handle:
-            if not line or line.startswith("#"):
-                continue
-            feature = line.split("\t", 1)[0]
-            if feature.startswith("UniRef50_"):
-                return "uniref50_level4ec"
-            return "uniref90_level4ec"
+    # Only the first data row matters; read raw blocks rather than decoding lines.
+    with genefamilies_file.open("rb", buffering=0) as handle:
+        pending = b""
+        while True:
+            block = handle.read(UNIREF_PROBE_SIZE)
+            lines = (pending + block).split(b"\n")
+            pending = lines.pop() if block else b""
+            for line in lines:
+                if not line or line.startswith(b"#"):
+                    continue
+                if line.startswith(b"UniRef50_"):
+                    return "uniref50_level4ec"
+                return "uniref90_level4ec"
+            if not block:
+                break
     raise RuntimeError(f"Could not detect UniRef scope in {genefamilies_file}")
 
 
@@ -76,6 +92,11 @@ def regroup_to_ec(genefamilies_cpm: Path, group_spec: str, output_path: Path) ->
 
 
 def process_sample(sample_dir: Path) -> None:
+    # One stat() for finished samples instead of checking every output on re-runs.
+    done_marker = sample_dir / DONE_MARKER
+    if done_marker.exists():
+        return
+
     sample = sample_dir.name
     tables: Dict[str, Path] = {
         "genefamilies": sample_dir / f"{sample}_genefamilies.tsv",
@@ -101,10 +122,15 @@ def process_sample(sample_dir: Path) -> None:
     ec_output = sample_dir / f"{sample}_genefamilies_cpm_level4ec.tsv"
     if ec_output.exists():
         print(f"Skipping EC regroup for {sample}: output already exists.")
+        done_marker.touch()
         return
 
-    groups = detect_uniref_scope(tables["genefamilies"])
+    groups = _UNIREF_CACHE.get(sample_dir.parent)
+    if groups is None:
+        groups = detect_uniref_scope(tables["genefamilies"])
+        _UNIREF_CACHE[sample_dir.parent] = groups
     regroup_to_ec(genefamilies_cpm, groups, ec_output)
+    done_marker.touch()
 
 
 def main() -> None:
@@ -115,11 +141,25 @@ def main() -> None:
         type=Path,
         help="Root directory containing per-sample HUMAnN output folders.",
     )
+    parser.add_argument(
+        "--jobs",
+        default=max(1, allocated_cpus() // 2),
+        type=positive_int,
+        help="Number of samples to post-process in parallel.",
+    )
     args, _ = parser.parse_known_args()
 
-    for sample_dir in sorted(args.output_root.iterdir()):
-        if sample_dir.is_dir():
-            process_sample(sample_dir)
+    # DirEntry.is_dir() uses the d_type from the directory listing, avoiding a
+    # stat() per sample on Lustre; only symlinked samples need one.
+    with os.scandir(args.output_root) as entries:
+        sample_dirs = sorted(
+            (Path(entry.path) for entry in entries if entry.is_dir()),
+            key=lambda path: path.name,
+        )
+    # Samples live in disjoint directories, so they can be processed independently.
+    workers = max(1, min(args.jobs, len(sample_dirs)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(process_sample, sample_dirs))
 
     print("HUMAnN post-processing complete.")
 
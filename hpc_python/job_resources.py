@@ -0,0 +1,32 @@
+"""
+Shared helpers for sizing worker pools inside LSF jobs and interactive sessions.
+
+Imported by the hpc_python scripts (which run as ``python hpc_python/<script>.py``,
+so this folder is already on sys.path); not meant to be run directly.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+
+
+def allocated_cpus() -> int:
+    """Return CPUs granted to this job (LSF slots or CPU affinity), not the whole node."""
+    lsf_slots = os.environ.get("LSB_DJOB_NUMPROC", "")
+    if lsf_slots.isdigit() and int(lsf_slots) > 0:
+        return int(lsf_slots)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def positive_int(value: str) -> int:
+    """argparse type for worker counts that must be at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}") from None
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
@@ -18,13 +18,19 @@ from __future__ import annotations
 
 import argparse
 import csv
+import itertools
+import mmap
+import operator
 import re
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Iterable, List, Optional
 
+from job_resources import allocated_cpus, positive_int
+
 in_ipython = "ipykernel" in sys.modules or "IPython" in sys.modules
 display_available = bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
 
@@ -34,9 +40,34 @@ try:
     if not in_ipython and not display_available and "MPLBACKEND" not in os.environ:
         matplotlib.use("Agg")
     import matplotlib.pyplot as plt
+    import numpy as np  # matplotlib dependency, used to build plot arrays
 except ImportError:  # pragma: no cover - optional dependency
     plt = None
 
+# Log-line discriminators and the trailing count, matched on raw bytes.
+RAW_PAIR1 = b"READ COUNT: raw pair1"
+CONTAM_TOTAL = b"Total contaminate sequences in file"
+FINAL_PAIR1 = b"READ COUNT: final pair1"
+FINAL_PAIR2 = b"READ COUNT: final pair2"
+PAIRED_CONTAM_1 = b"_paired_contam_1.fastq"
+UNMATCHED_1_CONTAM = b"_unmatched_1_contam.fastq"
+UNMATCHED_2_CONTAM = b"_unmatched_2_contam.fastq"
+TERMINAL_NUM_RE = re.compile(rb"([0-9]+(?:\.[0-9]+)?)%?\s*$")
+
+# Metric populated by each count line, and by each contaminant file suffix.
+COUNT_FIELDS = {
+    RAW_PAIR1: "total_reads",
+    FINAL_PAIR1: "final_paired_1_reads",
+    FINAL_PAIR2: "final_paired_2_reads",
+}
+CONTAM_FIELDS = (
+    (PAIRED_CONTAM_1, "host_paired_reads"),
+    (UNMATCHED_1_CONTAM, "host_orphan1_reads"),
+    (UNMATCHED_2_CONTAM, "host_orphan2_reads"),
+)
+# All discriminators as one alternation, so each log is scanned in a single pass.
+NEEDLE_RE = re.compile(b"|".join(re.escape(n) for n in (*COUNT_FIELDS, CONTAM_TOTAL)))
+
 
 @dataclass
 class SampleMetrics:
@@ -101,22 +132,31 @@ def parse_args() -> argparse.Namespace:
             "'show' displays inline; 'save' writes to disk; 'none' skips plotting."
         ),
     )
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=allocated_cpus(),
+        help="Number of worker processes used to parse kneaddata logs.",
+    )
     args, _ = parser.parse_known_args()
     return args
 
 
-def extract_terminal_number(line: str) -> Optional[int]:
+def extract_terminal_number(line: bytes) -> Optional[int]:
     """Return the final numeric value in a log line as an integer."""
-    maybe_value = line.strip().split(":")[-1].strip()
-    try:
-        if maybe_value.endswith("%"):
-            maybe_value = maybe_value[:-1]
-        return int(float(maybe_value))
-    except ValueError:
-        match = re.search(r"([0-9]+(?:\.[0-9]+)?)", line)
-        if match:
-            return int(float(match.group(1)))
-    return None
+    match = TERMINAL_NUM_RE.search(line)
+    return int(float(match.group(1))) if match else None
+
+
+def iter_matched_lines(mm: mmap.mmap) -> Iterable[tuple[bytes, bytes]]:
+    """Yield (needle, rest of line) for each log line containing a discriminator."""
+    match = NEEDLE_RE.search(mm)
+    while match:
+        end = mm.find(b"\n", match.end())
+        if end == -1:
+            end = len(mm)
+        yield match.group(0), mm[match.start():end]
+        match = NEEDLE_RE.search(mm, end)
 
 
 def parse_kneaddata_log(log_path: Path) -> SampleMetrics:
@@ -124,30 +164,21 @@ def parse_kneaddata_log(log_path: Path) -> SampleMetrics:
     sample_name = log_path.parent.name
     metrics = SampleMetrics(sample=sample_name)
 
-    with log_path.open("r", encoding="utf-8", errors="ignore") as handle:
-        for line in handle:
-            if "READ COUNT: raw pair1" in line:
-                value = extract_terminal_number(line)
-                if value is not None:
-                    metrics.total_reads = value
-            elif "Total contaminate sequences in file" in line:
-                value = extract_terminal_number(line)
-                if value is None:
-                    continue
-                if "_paired_contam_1.fastq" in line:
-                    metrics.host_paired_reads = value
-                elif "_unmatched_1_contam.fastq" in line:
-                    metrics.host_orphan1_reads = value
-                elif "_unmatched_2_contam.fastq" in line:
-                    metrics.host_orphan2_reads = value
-            elif "READ COUNT: final pair1" in line:
-                value = extract_terminal_number(line)
-                if value is not None:
-                    metrics.final_paired_1_reads = value
-            elif "READ COUNT: final pair2" in line:
-                value = extract_terminal_number(line)
-                if value is not None:
-                    metrics.final_paired_2_reads = value
+    with log_path.open("rb") as handle:
+        # mmap cannot map an empty file; such logs simply yield no metrics.
+        if os.fstat(handle.fileno()).st_size:
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for needle, line in iter_matched_lines(mm):
+                    value = extract_terminal_number(line)
+                    if value is None:
+                        continue
+                    if needle != CONTAM_TOTAL:
+                        setattr(metrics, COUNT_FIELDS[needle], value)
+                        continue
+                    for suffix, attr in CONTAM_FIELDS:
+                        if suffix in line:
+                            setattr(metrics, attr, value)
+                            break
 
     metrics.finalize()
     return metrics
@@ -202,43 +233,46 @@ def write_csv(metrics: List[SampleMetrics], csv_path: Path) -> None:
             )
 
 
+def format_count(value: Optional[float]) -> str:
+    """Format a read count with thousands separators, or NA when missing."""
+    if value is None:
+        return "NA"
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:,.2f}"
+    return f"{int(value):,}"
+
+
+def format_percent(value: Optional[float]) -> str:
+    """Format a fraction as a percentage, or NA when missing."""
+    return f"{value*100:.2f}%" if value is not None else "NA"
+
+
 def print_table(metrics: List[SampleMetrics]) -> None:
     """Emit a simple aligned table to stdout."""
     columns = [
-        ("Sample", "sample"),
-        ("Total", "total_reads"),
-        ("Host", "host_reads"),
-        ("Non-host", "non_host_reads"),
-        ("Final pair1", "final_paired_1_reads"),
-        ("Final pair2", "final_paired_2_reads"),
-        ("Host %", "host_fraction"),
+        ("Sample", "sample", str),
+        ("Total", "total_reads", format_count),
+        ("Host", "host_reads", format_count),
+        ("Non-host", "non_host_reads", format_count),
+        ("Final pair1", "final_paired_1_reads", format_count),
+        ("Final pair2", "final_paired_2_reads", format_count),
+        ("Host %", "host_fraction", format_percent),
     ]
+    getters = [operator.attrgetter(attr) for _, attr, _ in columns]
+    formatters = [fmt for _, _, fmt in columns]
+    rows = [
+        [fmt(get(metric)) for get, fmt in zip(getters, formatters)]
+        for metric in metrics
+    ]
+
     # Compute column widths based on stringified values
-    rows = []
-    for metric in metrics:
-        row = []
-        for _, attr in columns:
-            value = getattr(metric, attr)
-            if attr == "host_fraction":
-                row.append(f"{value*100:.2f}%" if value is not None else "NA")
-            elif value is None:
-                row.append("NA")
-            elif isinstance(value, (int, float)):
-                if isinstance(value, float) and not value.is_integer():
-                    row.append(f"{value:,.2f}")
-                else:
-                    row.append(f"{int(value):,}")
-            else:
-                row.append(str(value))
-        rows.append(row)
-
-    widths = []
-    for idx, (header, _) in enumerate(columns):
-        col_items = [row[idx] for row in rows] if rows else []
-        widths.append(max(len(header), *(len(item) for item in col_items)))
+    widths = [
+        max(itertools.chain([len(header)], (len(row[idx]) for row in rows)))
+        for idx, (header, _, _) in enumerate(columns)
+    ]
 
     header_line = " | ".join(
-        header.ljust(width) for width, (header, _) in zip(widths, columns)
+        header.ljust(width) for width, (header, _, _) in zip(widths, columns)
     )
     separator = "-+-".join("-" * width for width in widths)
     print(header_line)
@@ -261,17 +295,15 @@ def plot_host_contamination(
     if not metrics or plt is None:
         return None
 
-    samples = [m.sample for m in metrics if m.total_reads is not None]
-    host = [m.host_reads or 0 for m in metrics if m.total_reads is not None]
-    non_host = [
-        max((m.total_reads or 0) - (m.host_reads or 0), 0)
-        for m in metrics
-        if m.total_reads is not None
-    ]
-
-    if not samples:
+    valid = [m for m in metrics if m.total_reads is not None]
+    if not valid:
         return
 
+    samples = [m.sample for m in valid]
+    host = np.fromiter((m.host_reads or 0 for m in valid), dtype=np.int64, count=len(valid))
+    total = np.fromiter((m.total_reads for m in valid), dtype=np.int64, count=len(valid))
+    non_host = np.maximum(total - host, 0)
+
     fig, ax = plt.subplots(figsize=(max(8, len(samples) * 0.4), 6))
     ax.bar(samples, non_host, label="Remaining reads", color="#4C72B0")
     ax.bar(samples, host, bottom=non_host, label="Host contamination", color="#DD8452")
@@ -309,7 +341,8 @@ def main() -> None:
     if not logs:
         raise SystemExit(f"No kneaddata logs found under {kneaddata_root}")
 
-    metrics = [parse_kneaddata_log(log) for log in logs]
+    with ProcessPoolExecutor(max_workers=min(args.jobs, len(logs))) as executor:
+        metrics = list(executor.map(parse_kneaddata_log, logs, chunksize=8))
     metrics.sort(key=lambda m: m.sample)
 
     csv_path = output_dir / args.csv_name
@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
-import gzip
+import shutil
 from pathlib import Path
 
 input_dir = Path("/work3/trhova/metagenomics_input/cleaned_fastq")
 output_dir = Path("/work3/trhova/metagenomics_input/merged_fastq")
 output_dir.mkdir(exist_ok=True)
 
+# Copy buffer for the raw gzip-member concatenation.
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
 # Collect all R1 files
 r1_files = sorted(input_dir.glob("*_R1.fastq.gz"))
 
@@ -19,13 +22,12 @@ for r1 in r1_files:
     merged = output_dir / f"{sample}_merged.fastq.gz"
     print(f"Merging {r1.name} + {r2.name} -> {merged.name}")
 
-    with gzip.open(merged, "wb") as out_f:
+    # Concatenated gzip members form a valid multi-member .gz file that zcat and
+    # HUMAnN read transparently, so copy the compressed bytes as-is instead of
+    # decompressing and recompressing.
+    with open(merged, "wb") as out_f:
         for f in [r1, r2]:
-            with gzip.open(f, "rb") as in_f:
-                while True:
-                    chunk = in_f.read(1024 * 1024)
-                    if not chunk:
-                        break
-                    out_f.write(chunk)
+            with open(f, "rb") as in_f:
+                shutil.copyfileobj(in_f, out_f, length=COPY_BUFFER_SIZE)
 
 print("\n✅ Done merging all paired FASTQs for HUMAnN input.")
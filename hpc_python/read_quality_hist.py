@@ -6,7 +6,6 @@ Quick helper script: plot read quality distribution from a FASTQ file.
 import gzip
 import matplotlib.pyplot as plt
 import numpy as np
-from itertools import islice
 
 # Path to a cleaned FASTQ file (you can replace this later)
 fastq_path = "/work3/trhova/kneaddata_project/SA_24_09/kneaddata_output/Sample1/Sample1_1_kneaddata_paired_1.fastq"
@@ -15,27 +14,52 @@ fastq_path = "/work3/trhova/kneaddata_project/SA_24_09/kneaddata_output/Sample1/
 # -------------------------------------------------------------
 # Read PHRED quality scores
 # -------------------------------------------------------------
-def read_qualities(path, max_reads=50000):
-    quals = []
+BLOCK_SIZE = 4 << 20  # read FASTQ in 4 MiB blocks
+MAX_PHRED = 45
+
+
+def read_quality_counts(path, max_reads=50000):
+    """Return a histogram (counts per PHRED score) of the first max_reads reads."""
+    counts = np.zeros(MAX_PHRED, dtype=np.int64)
     open_func = gzip.open if path.endswith(".gz") else open
-    with open_func(path, "rt") as fh:
-        for i, line in enumerate(fh):
-            if (i % 4) == 3:  # quality line
-                quals.extend([ord(c) - 33 for c in line.strip()])
-            if max_reads and i > 4 * max_reads:
+    carry = b""
+    line_no = 0  # index of the first complete line in the current block
+    reads = 0
+    with open_func(path, "rb") as fh:
+        while True:
+            block = fh.read(BLOCK_SIZE)
+            if not block:
+                lines = [carry] if carry else []
+            else:
+                lines = (carry + block).split(b"\n")
+                carry = lines.pop()  # partial last line, completed by next block
+
+            qual_lines = lines[(3 - line_no) % 4::4]
+            if max_reads:
+                qual_lines = qual_lines[: max_reads - reads]
+            reads += len(qual_lines)
+            line_no += len(lines)
+
+            if qual_lines:
+                joined = b"".join(line.strip() for line in qual_lines)
+                arr = np.frombuffer(joined, dtype=np.uint8).astype(np.int16) - 33
+                # Drop scores outside the plotted range rather than clamping them.
+                arr = arr[(arr >= 0) & (arr < MAX_PHRED)]
+                counts += np.bincount(arr, minlength=MAX_PHRED)
+
+            if not block or (max_reads and reads >= max_reads):
                 break
-    return np.array(quals)
+    return counts
 
-qualities = read_qualities(fastq_path)
+quality_counts = read_quality_counts(fastq_path)
 
 # -------------------------------------------------------------
 # Plot histogram
 # -------------------------------------------------------------
 plt.figure(figsize=(7,4))
-plt.hist(qualities, bins=np.arange(0, 45), color="skyblue", edgecolor="black")
+plt.bar(np.arange(MAX_PHRED), quality_counts, width=1.0, align="edge", color="skyblue", edgecolor="black")
 plt.title("Read Quality Distribution")
 plt.xlabel("PHRED Quality Score")
 plt.ylabel("Count")
 plt.grid(alpha=0.2)
 plt.show()
-